@@ -2,8 +2,11 @@
 """
 
 import random
+import sys
 
-from milvus_server import default_server
+import grpc
+
+from milvus_server import default_server, MilvusServer
 
 
 from pymilvus import (
@@ -19,6 +22,8 @@ from pymilvus import (
 #   3. insert entities
 #   4. create index
 #   5. search
+#   6. restart server with preloading the collection
+#   7. check the unix domain socket listener
 
 # Optional, if you want store all related data to specific location
 # default it wil using %APPDATA%/milvus-io/milvus-server
@@ -137,6 +142,30 @@ def search(collection, vector_field, id_field, search_vectors):
             print("Top {}: {}".format(j, res))
 
 
+# Restart server, and preload collection before start() returns
+def restart_with_preload(name):
+    default_server.stop()
+    connections.disconnect('default')
+    # unix domain socket is not checked on windows
+    server = MilvusServer(preload=[name], preload_warmup=2,
+                          unix_socket=sys.platform != 'win32')
+    server.set_base_dir('test_milvus')
+    server.start()
+    print("\nPreload stats:", server.preload_stats)
+    assert server.preload_stats[name]['load_time'] > 0
+    assert server.preload_stats[name]['memory_size'] > 0
+    connections.connect(host=_HOST, port=server.listen_port)
+    return server
+
+
+# Check the proxy is reachable from server.uri with unix domain socket
+def check_uri(server):
+    print("\nCheck uri:", server.uri)
+    channel = grpc.insecure_channel(server.uri)
+    grpc.channel_ready_future(channel).result(timeout=10)
+    channel.close()
+
+
 def set_properties(collection):
     collection.set_properties(properties={"collection.ttl.seconds": 1800})
 
@@ -177,12 +206,22 @@ def main():
     # release memory
     release_collection(collection)
 
+    # restart with collection preloaded, it's searchable without load
+    server = restart_with_preload(_COLLECTION_NAME)
+    if server.unix_socket:
+        check_uri(server)
+    collection = Collection(_COLLECTION_NAME)
+    search(collection, _VECTOR_FIELD_NAME, _ID_FIELD_NAME, vectors[:3])
+    release_collection(collection)
+
     # drop collection index
     drop_index(collection)
 
     # drop collection
     drop_collection(_COLLECTION_NAME)
 
+    server.stop()
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
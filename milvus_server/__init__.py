@@ -8,29 +8,59 @@ import signal
 import sys
 import lzma
 from os import makedirs
-from os.path import join, abspath, dirname, expandvars, isfile
+from os.path import join, abspath, dirname, expandvars, isfile, isdir
 import re
 import subprocess
 import socket
-from time import sleep
+import random
+from time import sleep, monotonic
 
 __version__ = '2.2.3'
 
 
 LOGGERS = {}
 
+# CPU tuned binary variants under data/bin/<variant>, preferred first, with required cpu flags
+# flags cover what -march in run-prebuild.sh may emit, lzcnt is reported as abm
+CPU_AVX2_FLAGS = ('sse4_1', 'sse4_2', 'popcnt', 'pclmulqdq', 'aes', 'avx', 'avx2', 'fma', 'f16c',
+                  'bmi1', 'bmi2', 'abm', 'movbe', 'rdrand', 'fsgsbase', 'xsave', 'xsaveopt')
+CPU_AVX512_FLAGS = CPU_AVX2_FLAGS + ('avx512f', 'avx512cd', 'avx512bw', 'avx512dq', 'avx512vl',
+                                     'adx', 'rdseed', 'clflushopt', 'clwb', 'xsavec', 'xsaves')
+CPU_VARIANTS = (
+    ('avx512', CPU_AVX512_FLAGS),
+    ('avx2', CPU_AVX2_FLAGS),
+)
+
+
+def _split_names(text: str) -> list:
+    return [name.strip() for name in text.split(',') if name.strip()]
+
 
 def _initialize_data_files() -> None:
     bin_dir = join(dirname(abspath(__file__)), 'data', 'bin')
-    files = [file[:-5]
-             for file in os.listdir(bin_dir) if file.endswith('.lzma')]
-    files = [file for file in files if not isfile(
-        join(bin_dir, file)) or os.stat(join(bin_dir, file)).st_size < 10]
-    for file in files:
-        with lzma.LZMAFile(join(bin_dir, f'{file}.lzma'), mode='r') as lzma_file:
-            with open(join(bin_dir, file), 'wb') as raw:
-                raw.write(lzma_file.read())
-                os.chmod(join(bin_dir, file), 0o755)
+    bin_dirs = [bin_dir] + [join(bin_dir, variant)
+                            for variant, _ in CPU_VARIANTS if isdir(join(bin_dir, variant))]
+    for current_dir in bin_dirs:
+        files = [file[:-5]
+                 for file in os.listdir(current_dir) if file.endswith('.lzma')]
+        files = [file for file in files if not isfile(
+            join(current_dir, file)) or os.stat(join(current_dir, file)).st_size < 10]
+        for file in files:
+            with lzma.LZMAFile(join(current_dir, f'{file}.lzma'), mode='r') as lzma_file:
+                with open(join(current_dir, file), 'wb') as raw:
+                    raw.write(lzma_file.read())
+                    os.chmod(join(current_dir, file), 0o755)
+
+
+def _get_cpu_flags() -> set:
+    try:
+        with open('/proc/cpuinfo', 'r', encoding='utf-8') as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return set()
 
 
 def _create_logger(usage: str = 'null') -> logging.Logger:
@@ -53,6 +83,8 @@ def _create_logger(usage: str = 'null') -> logging.Logger:
 
 class MilvusServerConfig:
     RANDOM_PORT_START = 40000
+    # sun_path is 108 bytes on linux and 104 bytes on macOS, including the trailing NUL
+    UNIX_SOCKET_PATH_MAX = 103 if sys.platform.lower() == 'darwin' else 107
 
     def __init__(self, **kwargs):
         """create new configuration for milvus server
@@ -61,6 +93,8 @@ class MilvusServerConfig:
             template(str, optional): template file path
 
             data_dir(str, optional): base data directory for log and data
+
+            unix_socket(bool, optional): proxy also listens on unix domain socket under data_dir
         """
         self.base_data_dir = ''
         self.configs: dict = kwargs
@@ -116,8 +150,8 @@ class MilvusServerConfig:
 
     def resolve(self):
         self.cleanup_listen_ports()
-        self.resolve_all_listen_ports()
         self.resolve_storage()
+        self.resolve_all_listen_ports()
         for key, value in self.configurable_items.items():
             if value is None:
                 raise RuntimeError(
@@ -180,6 +214,7 @@ class MilvusServerConfig:
         self.base_data_dir = self.configs.get(
             'data_dir', self.get_default_data_dir())
         self.base_data_dir = abspath(self.base_data_dir)
+        self.resolve_unix_socket()
         makedirs(self.base_data_dir, exist_ok=True)
         config_dir = join(self.base_data_dir, 'configs')
         logs_dir = join(self.base_data_dir, 'logs')
@@ -207,6 +242,16 @@ class MilvusServerConfig:
         self.configurable_items['rocketmq_data_dir'] = join(
             storage_dir, 'rocketmq')
 
+    def resolve_unix_socket(self):
+        if self.configs.get('unix_socket', False):
+            unix_socket_path = join(self.base_data_dir, 'milvus.sock')
+            if len(unix_socket_path.encode()) > self.UNIX_SOCKET_PATH_MAX:
+                raise RuntimeError(
+                    f'unix socket path {unix_socket_path} is too long, please try a shorter data_dir')
+            self.configurable_items['proxy_unix_socket'] = unix_socket_path
+        else:
+            self.configurable_items['proxy_unix_socket'] = ''
+
     def cleanup_listen_ports(self):
         for data in self.listen_ports.values():
             if data[1]:
@@ -236,6 +281,11 @@ class MilvusServer:
             config (MilvusServerConfig, optional): the server config. Defaults to default_server_config.
 
         Kwargs:
+            preload(list or str, optional): collections, or comma separated names, to load and warm up once the server is ready
+
+            preload_warmup(int, optional): warm-up searches issued per preloaded collection, default 0
+
+            preload_timeout(float, optional): seconds to wait for readiness and loading in total, default 600
         """
         if not config:
             self.config = MilvusServerConfig()
@@ -246,14 +296,25 @@ class MilvusServer:
         self.proc_fds = {}
         self._debug = kwargs.get('debug', False)
         self.logger = _create_logger('debug' if self._debug else 'null')
+        preload = kwargs.get('preload', None) or []
+        self.preload = _split_names(preload) if isinstance(preload, str) else list(preload)
+        self.preload_warmup = int(kwargs.get('preload_warmup', 0))
+        self.preload_timeout = float(kwargs.get('preload_timeout', 600))
+        self.preload_stats = {}
 
     @classmethod
     def get_milvus_executable_path(cls):
-        """ get where milvus
+        """ get where milvus, prefer the best CPU tuned variant supported by host on linux
         """
+        bin_dir = join(dirname(abspath(__file__)), 'data', 'bin')
         if sys.platform.lower() == 'win32':
-            return join(dirname(abspath(__file__)), 'data', 'bin', 'milvus.exe')
-        return join(dirname(abspath(__file__)), 'data', 'bin', 'milvus')
+            return join(bin_dir, 'milvus.exe')
+        if sys.platform.lower() == 'linux':
+            cpu_flags = _get_cpu_flags()
+            for variant, flags in CPU_VARIANTS:
+                if isfile(join(bin_dir, variant, 'milvus')) and cpu_flags.issuperset(flags):
+                    return join(bin_dir, variant, 'milvus')
+        return join(bin_dir, 'milvus')
 
     def __enter__(self):
         self.start()
@@ -304,6 +365,15 @@ class MilvusServer:
                 stderr=self.proc_fds['stderr'],
                 env=envs)
         os.chdir(old_pwd)
+        if self.preload:
+            # one deadline for both readiness and loading
+            deadline = monotonic() + self.preload_timeout
+            try:
+                self.wait_until_ready(deadline - monotonic())
+                self.preload_collections(self.preload, deadline - monotonic())
+            except BaseException:
+                self.stop()
+                raise
 
     def stop(self):
         if self.server_proc:
@@ -314,6 +384,128 @@ class MilvusServer:
             fd.close()
         self.proc_fds.clear()
 
+    def wait_until_ready(self, timeout: float = 600):
+        """ wait until the proxy port accepts connections, raise RuntimeError if server exits or timeout
+
+        Note: proxy listens before it's healthy, preload_collections waits for health as well
+        """
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            if not self.running or self.server_proc.poll() is not None:
+                raise RuntimeError('Server exited before ready')
+            try:
+                with socket.create_connection((self.server_address, self.listen_port), timeout=1):
+                    self.logger.debug('server is listening on %d', self.listen_port)
+                    return
+            except OSError:
+                sleep(0.1)
+        raise RuntimeError(f'Server not ready after {timeout:.1f} seconds')
+
+    def preload_collections(self, names, timeout: float = 600):
+        """ load collections in parallel and block until all of them are fully loaded
+
+        pymilvus is required, load time and memory size of each collection is recorded in preload_stats
+        """
+        try:
+            from pymilvus import connections, utility, Collection
+        except ImportError as ex:
+            raise RuntimeError('pymilvus is required for preload collections') from ex
+        self.preload_stats.clear()
+        deadline = monotonic() + timeout
+        alias = f'milvus_server_preload_{id(self)}'
+        # pymilvus < 2.2.8 ignores a timeout which is not int
+        connections.connect(alias=alias, host=self.server_address,
+                            port=self.listen_port, timeout=int(max(deadline - monotonic(), 1)))
+        try:
+            self.wait_until_healthy(alias, deadline)
+            for name in names:
+                if not utility.has_collection(name, using=alias):
+                    raise RuntimeError(f'preload collection {name} does not exist')
+            start_at = monotonic()
+            collections = {name: Collection(name, using=alias) for name in names}
+            for name, collection in collections.items():
+                self.logger.debug('loading collection %s', name)
+                collection.load(_async=True)
+            pending = set(collections)
+            while pending:
+                for name in list(pending):
+                    progress = utility.loading_progress(name, using=alias)
+                    if str(progress.get('loading_progress', '')).strip() == '100%':
+                        pending.remove(name)
+                        self.preload_stats[name] = {'load_time': monotonic() - start_at}
+                        self.logger.debug('collection %s loaded in %.3f seconds',
+                                          name, self.preload_stats[name]['load_time'])
+                if pending and monotonic() > deadline:
+                    raise RuntimeError(
+                        f'preload collections {sorted(pending)} not finished in {timeout:.1f} seconds')
+                if pending:
+                    sleep(0.1)
+            for name, collection in collections.items():
+                self.warmup_collection(collection, self.preload_warmup)
+                segments = utility.get_query_segment_info(name, using=alias)
+                self.preload_stats[name]['memory_size'] = sum(
+                    segment.mem_size for segment in segments)
+                self.logger.debug('collection %s using %d bytes memory',
+                                  name, self.preload_stats[name]['memory_size'])
+        finally:
+            connections.disconnect(alias)
+
+    def wait_until_healthy(self, alias: str, deadline: float):
+        """ wait until the proxy serves requests, it rejects them before connected to all coordinators
+        """
+        from pymilvus import utility
+        while True:
+            if not self.running or self.server_proc.poll() is not None:
+                raise RuntimeError('Server exited before ready')
+            try:
+                utility.list_collections(using=alias)
+                return
+            except Exception as ex:
+                if monotonic() > deadline:
+                    raise RuntimeError(f'Server not healthy: {ex}') from ex
+                self.logger.debug('server not healthy yet: %s', ex)
+                sleep(0.5)
+
+    def warmup_collection(self, collection, count: int):
+        """ issue some random searches against the first vector field of collection
+        """
+        from pymilvus import DataType
+        fields = [field for field in collection.schema.fields
+                  if field.dtype in (DataType.FLOAT_VECTOR, DataType.BINARY_VECTOR)]
+        if count <= 0 or not fields:
+            return
+        field = fields[0]
+        dim = int(field.params['dim'])
+        metric_type = 'L2' if field.dtype == DataType.FLOAT_VECTOR else 'HAMMING'
+        index_type = 'FLAT'
+        for index in collection.indexes:
+            if index.field_name == field.name:
+                metric_type = index.params.get('metric_type', metric_type)
+                index_type = index.params.get('index_type', index_type)
+        search_params = self.get_warmup_search_params(index_type)
+        for _ in range(count):
+            if field.dtype == DataType.FLOAT_VECTOR:
+                vector = [random.random() for _ in range(dim)]
+            else:
+                vector = bytes(random.getrandbits(8) for _ in range(dim // 8))
+            collection.search(data=[vector], anns_field=field.name, limit=1,
+                              param={'metric_type': metric_type, 'params': search_params})
+
+    @classmethod
+    def get_warmup_search_params(cls, index_type: str) -> dict:
+        """ search params required by the index type, with small values as it's only for warm-up
+        """
+        index_type = index_type.upper()
+        if index_type.startswith('IVF') or index_type.startswith('BIN_IVF'):
+            return {'nprobe': 16}
+        if index_type == 'HNSW':
+            return {'ef': 64}
+        if index_type == 'DISKANN':
+            return {'search_list': 64}
+        if index_type == 'ANNOY':
+            return {'search_k': -1}
+        return {}
+
     def set_base_dir(self, dir_path):
         self.config.configs.update(data_dir=dir_path)
         self.config.resolve_storage()
@@ -326,6 +518,21 @@ class MilvusServer:
     def server_address(self) -> str:
         return '127.0.0.1'
 
+    @property
+    def unix_socket(self) -> bool:
+        return bool(self.config.configs.get('unix_socket', False))
+
+    @unix_socket.setter
+    def unix_socket(self, val: bool):
+        self.config.configs['unix_socket'] = val
+
+    @property
+    def uri(self) -> str:
+        unix_socket_path = self.config.configurable_items.get('proxy_unix_socket')
+        if unix_socket_path:
+            return f'unix:{unix_socket_path}'
+        return f'tcp://{self.server_address}:{self.listen_port}'
+
     @property
     def listen_port(self) -> int:
         return int(self.config.configurable_items.get('proxy_port', 0))
@@ -357,6 +564,8 @@ class MilvusServer:
             val_type = type(getattr(self, key))
             if val_type == bool:
                 val = val.lower() in ('true', 'yes')
+            elif val_type == list:
+                val = _split_names(val)
             else:
                 val = type(getattr(self, key))(val)
             setattr(self, key, val)
@@ -374,6 +583,9 @@ def main():
     parser.add_argument('--debug', action='store_true',
                         dest='debug', default=False)
     parser.add_argument('--data', dest='data_dir', default='')
+    parser.add_argument('--preload', action='append', dest='preload')
+    parser.add_argument('--preload-warmup', type=int,
+                        dest='preload_warmup', default=0)
     args = parser.parse_args()
 
     # select server
@@ -383,6 +595,11 @@ def main():
     if args.data_dir:
         server.set_base_dir(args.data_dir)
 
+    # collections to load on start
+    for names in args.preload or []:
+        server.preload.extend(_split_names(names))
+    server.preload_warmup = args.preload_warmup
+
     # apply configs
     for expression in args.values or []:
         if '=' in expression:
@@ -5,6 +5,10 @@
 MILVUS_REPO=${MILVUS_REPO:-https://github.com/milvus-io/milvus.git}
 MILVUS_COMMIT=${MILVUS_COMMIT:-8af2aebb66315717b4ba8a8538f5d8ffbe29e271}
 MILVUS_PATCH_NAME=${MILVUS_PATCH_NAME:-master}
+# extra CPU tuned variants for linux x86_64, e.g. "avx2 avx512"
+MILVUS_CPU_VARIANTS=${MILVUS_CPU_VARIANTS:-}
+# all variants known by cpu_variant_march and milvus_server.CPU_VARIANTS
+MILVUS_KNOWN_CPU_VARIANTS="avx2 avx512"
 BUILD_PROXY=
 
 export LANG=en_US.utf-8
@@ -15,7 +19,7 @@ BUILD_FORCE=NO
 cd $(dirname $0)
 
 # getopts
-while getopts "fr:b:p:" arg; do
+while getopts "fr:b:p:c:" arg; do
     case $arg in
         f)
             BUILD_FORCE=YES
@@ -29,6 +33,9 @@ while getopts "fr:b:p:" arg; do
         p)
             BUILD_PROXY=$OPTARG
         ;;
+        c)
+            MILVUS_CPU_VARIANTS=$OPTARG
+        ;;
         *)
         ;;
     esac
@@ -51,6 +58,13 @@ if [[ ! -d milvus ]] ; then
     git clone ${MILVUS_REPO} milvus
     cd milvus
     git checkout ${MILVUS_COMMIT}
+    # check milvus patch applies cleanly before touching the source
+    if ! patch -p1 --dry-run < ../milvus_patches/${MILVUS_PATCH_NAME}.patch ; then
+        echo "milvus_patches/${MILVUS_PATCH_NAME}.patch does not apply on ${MILVUS_COMMIT}"
+        cd -
+        rm -fr milvus
+        exit 1
+    fi
     # apply milvus patch
     patch -p1 < ../milvus_patches/${MILVUS_PATCH_NAME}.patch
     cd -
@@ -96,6 +110,53 @@ function build_msys() {
     done
 }
 
+# march for each CPU tuned variant, flags checked at runtime are in milvus_server.CPU_VARIANTS
+function cpu_variant_march() {
+    case $1 in
+        avx2)
+            echo haswell
+        ;;
+        avx512)
+            echo skylake-avx512
+        ;;
+        *)
+            echo "Not supported cpu variant: $1" >&2
+            exit 1
+        ;;
+    esac
+}
+
+# copy milvus and the shared libraries it needs into current dir
+function collect_linux_libs() {
+    src_dir=$1
+    for x in $(ldd milvus | awk '{print $1}') ; do
+        if [[ $x =~ libc.so.* ]] ; then
+            :
+        elif [[ $x =~ libdl.so.* ]] ; then
+            :
+        elif [[ $x =~ libm.so.* ]] ; then
+            :
+        elif [[ $x =~ librt.so.* ]] ; then
+            :
+        elif [[ $x =~ libpthread.so.* ]] ; then
+            :
+        elif test -f $x ; then
+            :
+        else
+            echo $x
+            for p in ${src_dir}/internal/core/output/lib ${src_dir}/internal/core/output/lib64 /lib64 /usr/lib64 /usr/local/lib64 /usr/local/lib /usr/lib64/boost169 ; do
+                if test -f $p/$x && ! test -f $x ; then
+                    file=$p/$x
+                    while test -L $file ; do
+                        file=$(dirname $file)/$(readlink $file)
+                    done
+                    cp -frv $file $x
+                fi
+            done
+        fi
+    done
+}
+
 function build_linux_x86_64() {
     if [[ ${BUILD_ALREADY_IN_DOCKER} == "YES" ]] ; then
         set -e
@@ -105,36 +166,33 @@ function build_linux_x86_64() {
         elif [[ -d /src/milvus ]] ; then
             cd /src/milvus
         fi
+        src_dir=$(pwd)
+
+        # remove variants from previous builds, they would be packaged and preferred at runtime
+        for variant in ${MILVUS_KNOWN_CPU_VARIANTS} ; do
+            rm -fr bin/${variant}
+        done
+
+        # CPU tuned variants, each one is a full rebuild into bin/<variant>
+        for variant in ${MILVUS_CPU_VARIANTS} ; do
+            march=$(cpu_variant_march ${variant})
+            rm -fr cmake_build internal/core/output bin/milvus
+            CFLAGS="-march=${march}" CXXFLAGS="-march=${march}" make -j $(nproc) milvus
+            mkdir -p bin/${variant}
+            mv bin/milvus bin/${variant}/milvus
+            cd bin/${variant}
+            collect_linux_libs ${src_dir}
+            cd ${src_dir}
+        done
+
+        # the generic one
+        if [[ "${MILVUS_CPU_VARIANTS}" != "" ]] ; then
+            rm -fr cmake_build internal/core/output bin/milvus
+        fi
         make -j $(nproc) milvus
         cd bin
         rm -fr lib*
-
-        for x in $(ldd milvus | awk '{print $1}') ; do
-            if [[ $x =~ libc.so.* ]] ; then
-                :
-            elif [[ $x =~ libdl.so.* ]] ; then
-                :
-            elif [[ $x =~ libm.so.* ]] ; then
-                :
-            elif [[ $x =~ librt.so.* ]] ; then
-                :
-            elif [[ $x =~ libpthread.so.* ]] ; then
-                :
-            elif test -f $x ; then
-                :
-            else
-                echo $x
-                for p in ../internal/core/output/lib ../internal/core/output/lib64 /lib64 /usr/lib64 /usr/local/lib64 /usr/local/lib /usr/lib64/boost169 ; do
-                    if test -f $p/$x && ! test -f $x ; then
-                        file=$p/$x
-                        while test -L $file ; do
-                            file=$(dirname $file)/$(readlink $file)
-                        done
-                        cp -frv $file $x
-                    fi
-                done
-            fi
-        done
+        collect_linux_libs ${src_dir}
     else
         
         docker_build_proxys=
@@ -147,6 +205,7 @@ function build_linux_x86_64() {
         ## docker build -t matrixji/python-milvus-server-builder:latest ${docker_build_proxys} tools/build-env-manylinux2014
         mkdir -p tmp
         docker run -u $(id -u):$(id -g) -e HOME=/tmp -e BUILD_ALREADY_IN_DOCKER=YES --rm -ti ${docker_run_proxys} \
+            -e MILVUS_CPU_VARIANTS="${MILVUS_CPU_VARIANTS}" \
             -v$(pwd):/src \
             -v$(pwd)/tmp:/tmp \
             matrixji/python-milvus-server-builder:manylinux2004-1 bash -c "cd /src && bash run-prebuild.sh"
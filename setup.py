@@ -1,3 +1,4 @@
+import ast
 import os
 import pathlib
 import shutil
@@ -16,6 +17,18 @@ def get_package_version():
     return f'{base_version}.dev{datetime.now().strftime("%Y%m%d%H%M")}'
 
 
+def get_cpu_variants():
+    """ variant names in milvus_server.CPU_VARIANTS, parsed as the package could not be imported here
+    """
+    source = (pathlib.Path(__file__).parent / 'milvus_server' /
+              '__init__.py').read_text(encoding='utf-8')
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Assign) and \
+                any(isinstance(target, ast.Name) and target.id == 'CPU_VARIANTS' for target in node.targets):
+            return [ast.literal_eval(item.elts[0]) for item in node.value.elts]
+    return []
+
+
 def guess_plat_name():
     if 'MILVUS_SERVER_PLATFORM' in environ:
         return environ['MILVUS_SERVER_PLATFORM']
@@ -49,13 +62,23 @@ class CustomBuild(build):
         dest_bin_dir = join(dirname(abspath(__file__)),
                             'milvus_server', 'data', 'bin')
         shutil.rmtree(dest_bin_dir, ignore_errors=True)
+        cls.copy_bin_dir(milvus_server_bin_dir, dest_bin_dir)
+        # CPU tuned variants built by run-prebuild.sh, e.g. milvus/bin/avx2/milvus
+        for variant in get_cpu_variants():
+            if isfile(join(milvus_server_bin_dir, variant, 'milvus')):
+                cls.copy_bin_dir(join(milvus_server_bin_dir, variant),
+                                 join(dest_bin_dir, variant))
+
+    @classmethod
+    def copy_bin_dir(cls, milvus_server_bin_dir, dest_bin_dir):
         makedirs(dest_bin_dir, exist_ok=True)
         for filename in listdir(milvus_server_bin_dir):
             filepath = join(milvus_server_bin_dir, filename)
+            if not isfile(filepath):
+                continue
             ext_name = filepath.rsplit('.')[-1]
             dest_filepath = join(dest_bin_dir, filename)
-            if isfile(filepath):
-                shutil.copy(filepath, dest_filepath, follow_symlinks=False)
+            shutil.copy(filepath, dest_filepath, follow_symlinks=False)
             if ext_name != 'lzma':
                 try:
                     if not islink(dest_filepath):
@@ -86,7 +109,7 @@ setup(name='python-milvus-server',
           'milvus_server': 'milvus_server'
       },
       package_data={
-          'milvus_server': ['data/bin/*', 'data/*.template'],
+          'milvus_server': ['data/bin/*', 'data/bin/*/*', 'data/*.template'],
       },
       options={
           'bdist_wheel': {'plat_name': guess_plat_name()}